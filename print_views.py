@@ -34,6 +34,19 @@ ROTATE_CW_2 = '-180'
 
 ROTATIONS = [ROTATE_CW_2, ROTATE_CW, ROTATE_ACW, ROTATE_ACW_2]
 
+STATISTIC_SEPARATOR = ':'  # separates an aspect from its statistic
+
+MAX_STATISTIC = 'max'  # whether there are any filled voxels behind a pixel
+COUNT_STATISTIC = 'count'  # the number of filled voxels behind a pixel
+# the distance to the nearest filled voxel (the axis length if there is none)
+DEPTH_STATISTIC = 'depth'
+
+STATISTICS = [MAX_STATISTIC, COUNT_STATISTIC, DEPTH_STATISTIC]
+
+BINARY_TILES = ['  ', 'XX']
+# tiles for graded images, from blank to the highest value
+GRADED_TILES = ['  ', '..', '::', '--', '==', '++', '**', '##', '%%', '@@']
+
 # axes in a 3D bitmap (block array)
 X = 2
 Y = 1
@@ -43,20 +56,79 @@ TRANSPOSE = "transpose"
 
 BOOLEAN_LIST_REGEX = '([01]+)b'  # boolean list literal in q
 
+# a named boolean list in q, e.g. the "d:0101b" lines printed by the decoder
+NAMED_BOOLEAN_LIST_REGEX = '([a-zA-Z][a-zA-Z0-9_]*):([01]+)b'
+
+# tokens in a block expression: a block name or a single-character operator
+EXPR_TOKEN_REGEX = r'\s*(?:([a-zA-Z][a-zA-Z0-9_]*)|(\S))'
+
+# the number of planes (along axis Z) evaluated at a time by an expression
+EXPR_CHUNK_PLANES = 8
+
+
+class AxisStatistics(object):
+    """Statistics of a block along one of its axes: for each line of voxels
+    parallel to the axis, whether any voxel is filled (max), how many are
+    filled (count) and the indices of the first and last filled ones (-1 for
+    an empty line). All of them are gathered in one traversal of the block,
+    plane by plane, and can serve the views from both ends of the axis."""
+
+    def __init__(self, block, axis):
+        shape = block.shape
+        view_shape = shape[:axis] + shape[axis + 1:]
+        self.length = shape[axis]
+        self.count = np.zeros(view_shape, dtype=np.intp)
+        self.first = np.full(view_shape, -1, dtype=np.intp)
+        self.last = np.full(view_shape, -1, dtype=np.intp)
+        index = [slice(None)] * len(shape)
+        for i in range(self.length):
+            index[axis] = i
+            hit = block[tuple(index)] != 0
+            self.count += hit
+            np.copyto(self.first, i, where=hit & (self.first < 0))
+            np.copyto(self.last, i, where=hit)
+        self.max = (self.count > 0).astype(np.uint8)
+
+    def depth(self, from_last):
+        """Returns the distance from the near face of the block to the first
+        filled voxel, or the length of the axis where there is none. The near
+        face is the one with the highest index along the axis if from_last is
+        true."""
+        if from_last:
+            return np.where(self.last < 0, self.length,
+                            self.length - 1 - self.last)
+        return np.where(self.first < 0, self.length, self.first)
+
 
 class StandardViewpoint(object):
-    def __init__(self, view_axis, tweaks):
+    def __init__(self, view_axis, tweaks, from_last=False):
         self.view_axis = view_axis
         self.tweaks = tweaks
+        # whether the viewer faces the block side with the highest index
+        self.from_last = from_last
 
     def project(self, block, extra_tweaks=None):
         """Returns a parallel projection of a block along self.view_axis,
         optionally applying postprocessing tweaks (a sequence of flip and
         transpose operations). Because projections are parallel to the block's
-        axes, there is no need to use a transform matrix, and the method
-        apply_along_axis() does the job fine."""
-        view = np.apply_along_axis(np.max, self.view_axis, block)
+        axes, there is no need to use a transform matrix, and the array
+        method max() does the job fine. The block can be a numpy array or a
+        BlockExpression, which pushes the reduction down into its operands."""
+        view = block.max(axis=self.view_axis)
+        return self.apply_tweaks(view, extra_tweaks)
+
+    def project_statistic(self, statistics, statistic, extra_tweaks=None):
+        """Returns a projection made of one of the precomputed statistics of
+        the block along self.view_axis."""
+        if statistic == MAX_STATISTIC:
+            view = statistics.max
+        elif statistic == COUNT_STATISTIC:
+            view = statistics.count
+        else:
+            view = statistics.depth(self.from_last)
+        return self.apply_tweaks(view, extra_tweaks)
 
+    def apply_tweaks(self, view, extra_tweaks=None):
         if extra_tweaks is not None:
             combined_tweaks = []
             combined_tweaks.extend(self.tweaks)
@@ -74,9 +146,9 @@ class StandardViewpoint(object):
 
 class Projector(object):
     def __init__(self):
-        views = {TOP_VIEW: StandardViewpoint(Y, [0]),
-                 FRONT_VIEW: StandardViewpoint(Z, []),
-                 RIGHT_VIEW: StandardViewpoint(X, [TRANSPOSE, 1]),
+        views = {TOP_VIEW: StandardViewpoint(Y, [0], True),
+                 FRONT_VIEW: StandardViewpoint(Z, [], True),
+                 RIGHT_VIEW: StandardViewpoint(X, [TRANSPOSE, 1], True),
                  BOTTOM_VIEW: StandardViewpoint(Y, []),
                  BACK_VIEW: StandardViewpoint(Z, [1]),
                  LEFT_VIEW: StandardViewpoint(X, [TRANSPOSE])}
@@ -101,11 +173,65 @@ class Projector(object):
         rotation = aspect_match.group(2)
         return view_name, rotation
 
-    def project(self, block, aspect):
+    def split_statistic(self, aspect):
+        """Splits an aspect of the form "front+90:count" into the aspect
+        proper and the name of a statistic (None if there is no statistic)."""
+        if aspect is None:
+            return None, None
+        aspect, separator, statistic = aspect.partition(STATISTIC_SEPARATOR)
+        if not separator:
+            return aspect, None
+        if statistic not in STATISTICS:
+            raise RuntimeError(f'Unknown statistic: "{statistic}"')
+        return aspect, statistic
+
+    def resolve_aspect(self, aspect):
+        """Returns the viewpoint, rotation tweaks and statistic (or None) that
+        are specified by the aspect."""
+        aspect, statistic = self.split_statistic(aspect)
         view_name, rotation = self.parse_aspect(aspect)
         view = self.get_view(view_name)
-        tweaks = self.get_rotation_tweaks(rotation)
-        return view.project(block, tweaks)
+        return view, self.get_rotation_tweaks(rotation), statistic
+
+    def project(self, block, aspect, statistics=None):
+        """Projects the block as indicated by the aspect. The statistics of the
+        block are computed once per axis and cached in the statistics dict
+        (if given), so that e.g. "front:count back:depth" share them. Plain
+        aspects use the cached max where there is one, and block.max()
+        otherwise."""
+        view, tweaks, statistic = self.resolve_aspect(aspect)
+        if statistic is None:
+            if statistics is None or view.view_axis not in statistics:
+                return view.project(block, tweaks)
+            statistic = MAX_STATISTIC
+        if statistics is None:
+            statistics = {}
+        if view.view_axis not in statistics:
+            statistics[view.view_axis] = AxisStatistics(block, view.view_axis)
+        return view.project_statistic(statistics[view.view_axis], statistic,
+                                      tweaks)
+
+    def get_views(self, block, view_spec):
+        """Yields a triple (statistic, rows, top) per each aspect in the view
+        specifier, where rows are the rows of the projection, top first, and
+        top is the highest value that the projection can have."""
+        aspects = view_spec.split()
+        statistics = {}  # shared by all the aspects of the block
+        # gather the statistics first, so that a plain aspect on the same axis
+        # (like "front" in "front back:count") doesn't traverse the block again
+        for aspect in aspects:
+            view, tweaks, statistic = self.resolve_aspect(aspect)
+            axis = view.view_axis
+            if statistic is not None and axis not in statistics:
+                statistics[axis] = AxisStatistics(block, axis)
+        for aspect in aspects:
+            view, tweaks, statistic = self.resolve_aspect(aspect)
+            rows = np.flip(self.project(block, aspect, statistics), 0)
+            if statistic in [COUNT_STATISTIC, DEPTH_STATISTIC]:
+                top = max(block.shape[view.view_axis], 1)
+            else:
+                top = 1
+            yield statistic, rows, top
 
     def get_images(self, block, view_spec, tiles=None):
         """Yields a flat (two-dimensional) ASCII rendition of the specified
@@ -113,13 +239,35 @@ class Projector(object):
         specifier (a string containing a space-separated list of aspects).
         Also allows the caller to specify custom tiles for blank and filled
         voxels in the block. By default the tiles are '  ' and 'XX',
-        respectively."""
-        if tiles is None:
-            tiles = ['  ', 'XX']
-        for aspect in view_spec.split():
-            view = self.project(block, aspect)
-            rows = np.flip(view, 0)
-            yield "\n".join([''.join([tiles[c] for c in r]) for r in rows])
+        respectively. Custom tiles are indexed by the values of the
+        projection as they are, whereas counts and depths drawn with the
+        default GRADED_TILES are scaled to the number of tiles, with the
+        nearest voxels getting the darkest tiles."""
+        for statistic, rows, top in self.get_views(block, view_spec):
+            if tiles is not None:
+                image_tiles = tiles
+            elif statistic in [COUNT_STATISTIC, DEPTH_STATISTIC]:
+                image_tiles = GRADED_TILES
+                if statistic == DEPTH_STATISTIC:
+                    rows = top - rows  # the nearest voxels are the darkest
+                levels = len(image_tiles) - 1
+                # round up so that any non-zero value gets a non-blank tile
+                rows = (rows * levels + top - 1) // top
+            else:
+                image_tiles = BINARY_TILES
+            yield "\n".join([''.join([image_tiles[c] for c in r])
+                             for r in rows])
+
+    def get_pgms(self, block, view_spec):
+        """Yields a greyscale image in the plain PGM format per each aspect
+        in the view specifier. The maximum grey value is 1 for max views and
+        the length of the viewing axis for counts and depths, so that it also
+        marks the lines of voxels with no filled voxel in depth views."""
+        for statistic, rows, top in self.get_views(block, view_spec):
+            height, width = rows.shape
+            lines = [f"P2\n{width} {height}\n{top}"]
+            lines.extend(' '.join(str(c) for c in r) for r in rows)
+            yield "\n".join(lines)
 
     def get_rotation_tweaks(self, rotation):
         """Obtains a list of primitive numpy operations (flip, transpose) that,
@@ -156,6 +304,7 @@ class BlockBuilder(object):
         self.dims = dims
         # a bitmap is a string of '0' and '1' characters ending with a 'b'
         self.bitmap_re = re.compile(BOOLEAN_LIST_REGEX)
+        self.named_bitmap_re = re.compile(NAMED_BOOLEAN_LIST_REGEX)
 
     def block_dims(self, bits):
         if self.dims is not None:
@@ -172,33 +321,238 @@ class BlockBuilder(object):
             dims = self.block_dims(bits)
             yield build_block(bits, dims)
 
+    def parse_named_blocks(self, line):
+        """Yields (name, block) pairs for each named bitmap on the line, such
+        as the "d:0101b" assignments printed by the decoder."""
+        for bitmap_match in self.named_bitmap_re.finditer(line):
+            name = bitmap_match.group(1)
+            bits = bitmap_match.group(2)
+            dims = self.block_dims(bits)
+            yield name, build_block(bits, dims)
+
+
+class BlockNode(object):
+    """A node in the tree of a block expression. Evaluating a node over a
+    region of the blocks returns a pair (array, owned), where owned tells
+    whether the array is a temporary that the caller is free to overwrite."""
+
+    def evaluate(self, blocks, index):
+        raise NotImplementedError
+
+    def names(self):
+        raise NotImplementedError
+
+    def max(self, expression, axis):
+        """Returns the max projection of this node along an axis. By default
+        the node is evaluated chunk by chunk and each chunk is reduced."""
+        return expression.reduce_chunks(self, axis)
+
+
+class BlockRef(BlockNode):
+    def __init__(self, name):
+        self.name = name
+
+    def evaluate(self, blocks, index):
+        return blocks[self.name][index], False
+
+    def names(self):
+        return {self.name}
+
+    def max(self, expression, axis):
+        return expression.blocks[self.name].max(axis=axis)
+
+
+class BlockNot(BlockNode):
+    def __init__(self, operand):
+        self.operand = operand
+
+    def evaluate(self, blocks, index):
+        a, owned = self.operand.evaluate(blocks, index)
+        # the blocks hold 0/1 flags, so flipping the lowest bit negates them
+        return np.bitwise_xor(a, np.uint8(1), out=a if owned else None), True
+
+    def names(self):
+        return self.operand.names()
+
+
+class BlockOp(BlockNode):
+    def __init__(self, ufunc, left, right):
+        self.ufunc = ufunc
+        self.left = left
+        self.right = right
+
+    def evaluate(self, blocks, index):
+        a, a_owned = self.left.evaluate(blocks, index)
+        b, b_owned = self.right.evaluate(blocks, index)
+        # reuse an operand's temporary for the result where there is one
+        out = a if a_owned else b if b_owned else None
+        return self.ufunc(a, b, out=out), True
+
+    def names(self):
+        return self.left.names() | self.right.names()
+
+    def max(self, expression, axis):
+        # max(a | b) == max(a) | max(b), which is not true of & and ^
+        if self.ufunc is np.bitwise_or:
+            return np.bitwise_or(self.left.max(expression, axis),
+                                 self.right.max(expression, axis))
+        return super(BlockOp, self).max(expression, axis)
+
+
+class ExpressionParser(object):
+    """Parses block expressions such as "d & ~l" into a tree of BlockNode
+    objects. The operators are, in the order of increasing precedence: '|',
+    '^', '&' and '~' (the same as in Python); parentheses are supported."""
+
+    def __init__(self):
+        self.token_re = re.compile(EXPR_TOKEN_REGEX)
+        # binary operators, from the lowest to the highest precedence
+        self.binary_ops = [('|', np.bitwise_or), ('^', np.bitwise_xor),
+                           ('&', np.bitwise_and)]
+        self.tokens = []
+        self.pos = 0
+
+    def parse(self, text):
+        self.tokens = [m.group(1) or m.group(2)
+                       for m in self.token_re.finditer(text)]
+        self.pos = 0
+        node = self.parse_binary(0)
+        if self.pos < len(self.tokens):
+            raise RuntimeError(f'Unexpected "{self.tokens[self.pos]}"'
+                               f' in expression "{text}"')
+        return node
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def advance(self):
+        token = self.peek()
+        if token is None:
+            raise RuntimeError('Unexpected end of expression')
+        self.pos += 1
+        return token
+
+    def parse_binary(self, level):
+        if level == len(self.binary_ops):
+            return self.parse_unary()
+        op, ufunc = self.binary_ops[level]
+        node = self.parse_binary(level + 1)
+        while self.peek() == op:
+            self.advance()
+            node = BlockOp(ufunc, node, self.parse_binary(level + 1))
+        return node
+
+    def parse_unary(self):
+        token = self.advance()
+        if token == '~':
+            return BlockNot(self.parse_unary())
+        if token == '(':
+            node = self.parse_binary(0)
+            if self.advance() != ')':
+                raise RuntimeError('Expected ")" in expression')
+            return node
+        if token[0].isalpha():
+            return BlockRef(token)
+        raise RuntimeError(f'Unexpected "{token}" in expression')
+
+
+class BlockExpression(object):
+    """A lazy expression over named blocks. Indexing it evaluates just the
+    requested region, and all the operators are fused over that region, so
+    no full-size temporary is created per operator. The max() method mirrors
+    the one of numpy arrays, which lets a viewpoint project the expression
+    like an ordinary block."""
+
+    def __init__(self, tree, blocks, chunk_planes=EXPR_CHUNK_PLANES):
+        shapes = set()
+        for name in sorted(tree.names()):
+            if name not in blocks:
+                raise RuntimeError(f'Unknown block name: "{name}"')
+            shapes.add(blocks[name].shape)
+        if len(shapes) != 1:
+            raise RuntimeError(f'Block shapes do not match: {sorted(shapes)}')
+        self.tree = tree
+        self.blocks = blocks
+        self.shape = shapes.pop()
+        self.chunk_planes = chunk_planes
+
+    def __getitem__(self, index):
+        a, owned = self.tree.evaluate(self.blocks, index)
+        return a
+
+    def chunks(self):
+        """Yields slices that divide the block into chunks along axis Z."""
+        for start in range(0, self.shape[Z], self.chunk_planes):
+            yield slice(start, start + self.chunk_planes)
+
+    def evaluate(self):
+        block = np.empty(self.shape, dtype=np.uint8)
+        for chunk in self.chunks():
+            block[chunk] = self[chunk]
+        return block
+
+    def max(self, axis):
+        return self.tree.max(self, axis)
+
+    def reduce_chunks(self, node, axis):
+        """Evaluates the node chunk by chunk, reducing each chunk along the
+        axis as soon as it is available."""
+        view_shape = self.shape[:axis] + self.shape[axis + 1:]
+        view = np.zeros(view_shape, dtype=np.uint8)
+        for chunk in self.chunks():
+            a, owned = node.evaluate(self.blocks, chunk)
+            if axis == Z:
+                np.maximum(view, a.max(axis=Z), out=view)
+            else:
+                view[chunk] = a.max(axis=axis)
+        return view
+
 
 class Printer(object):
     def __init__(self):
         self.builder = BlockBuilder()
+        self.parser = ExpressionParser()
         self.projector = Projector()
         self.default_view = DEFAULT_VIEW
         self.image_spacer = "\n\n"
 
-    def print_views(self, file_names, view_specs):
+    def read_blocks(self, file_names, expr=None):
+        """Yields the blocks found in the input files. If an expression is
+        given, yields a single BlockExpression over the named blocks instead.
+        """
+        if expr is None:
+            for line in fileinput.input(file_names):
+                yield from self.builder.parse_blocks(line)
+            return
+        tree = self.parser.parse(expr)  # fail early on a malformed expression
+        blocks = {}
+        for line in fileinput.input(file_names):
+            blocks.update(self.builder.parse_named_blocks(line))
+        yield BlockExpression(tree, blocks)
+
+    def print_views(self, file_names, view_specs, expr=None, pgm=False):
         if view_specs is None:
             view_specs = []  # no "TypeError: 'NoneType' object is not iterable"
         view_iter = iter(view_specs)  # should contain one view_spec per block
         view_spec = self.default_view
 
         continued = False
-        for line in fileinput.input(file_names):
-            blocks = self.builder.parse_blocks(line)
-            for block in blocks:
-                # preserve and use the last view_spec if view_specs is too short
-                view_spec = next(view_iter, view_spec)
+        for block in self.read_blocks(file_names, expr):
+            # preserve and use the last view_spec if view_specs is too short
+            view_spec = next(view_iter, view_spec)
 
-                for image in self.projector.get_images(block, view_spec):
-                    if continued:
-                        print(self.image_spacer)
-                    else:
-                        continued = True
-                    print(image)
+            if pgm:
+                images = self.projector.get_pgms(block, view_spec)
+            else:
+                images = self.projector.get_images(block, view_spec)
+            for image in images:
+                if continued:
+                    print(self.image_spacer)
+                else:
+                    continued = True
+                print(image)
 
 
 if __name__ == '__main__':
@@ -208,13 +562,22 @@ if __name__ == '__main__':
     parser.add_argument('-V', '--views', metavar='"VIEW [VIEW ...]"',
                         action='append',
                         help='draw the specified views' +
-                             '; VIEW has the format NAME[ROT]' +
+                             '; VIEW has the format NAME[ROT][:STAT]' +
                              ' where NAME is one of ' + str(VIEWS) +
-                             ' and ROT is one of ' + str(ROTATIONS) +
+                             ', ROT is one of ' + str(ROTATIONS) +
+                             ' and STAT is one of ' + str(STATISTICS) +
+                             ' (depth is the distance to the nearest' +
+                             ' filled voxel, or the axis length if none)' +
                              '; you can use multiple --views options' +
                              ' (one per each 3D bitmap)')
+    parser.add_argument('-e', '--expr', metavar='EXPR',
+                        help='draw the views of a combination of named' +
+                             ' 3D bitmaps, e.g. "d & ~l"; EXPR can use' +
+                             ' the operators ~ & ^ | and parentheses')
+    parser.add_argument('-p', '--pgm', action='store_true',
+                        help='print the views as plain PGM images')
     parser.add_argument('files', nargs='*', metavar='FILE',
                         help='input file to read; use "-" for standard input')
     args = parser.parse_args()
     printer = Printer()
-    printer.print_views(args.files, args.views)
+    printer.print_views(args.files, args.views, args.expr, args.pgm)
@@ -4,7 +4,8 @@ import numpy as np
 
 from print_views import BlockBuilder, build_block, Projector, TOP_VIEW, \
     FRONT_VIEW, RIGHT_VIEW, \
-    BOTTOM_VIEW, BACK_VIEW, LEFT_VIEW
+    BOTTOM_VIEW, BACK_VIEW, LEFT_VIEW, BlockExpression, ExpressionParser, \
+    X, Y, Z, AxisStatistics
 
 __author__ = "Igor Mironov"
 __copyright__ = "Copyright 2019, Igor Mironov"
@@ -48,6 +49,18 @@ class BlockBuilderTest(unittest.TestCase):
         assert_array_equal(self.array_3, next(blocks))
         assert_array_equal(self.array_2, next(blocks))
 
+    def test_parse_named_blocks(self):
+        builder = BlockBuilder()
+        blocks = builder.parse_named_blocks(
+            f"d:{self.input_2}\nl:{self.input_3} {self.input_2}")
+        name, block = next(blocks)
+        self.assertEqual('d', name)
+        assert_array_equal(self.array_2, block)
+        name, block = next(blocks)
+        self.assertEqual('l', name)
+        assert_array_equal(self.array_3, block)
+        self.assertRaises(StopIteration, next, blocks)  # unnamed bitmap
+
     def test_parse_rect(self):
         builder = BlockBuilder([2, 4])
         blocks = builder.parse_blocks(f"{self.input_2} {self.input_3}")
@@ -104,6 +117,159 @@ class ProjectorTest(unittest.TestCase):
         self.assertEqual(projector.parse_aspect('bar-1'), ('bar', '-1'))
         self.assertEqual(projector.parse_aspect('baz+123'), ('baz', '+123'))
 
+    def test_split_statistic(self):
+        projector = Projector()
+        self.assertEqual(projector.split_statistic('top'), ('top', None))
+        self.assertEqual(projector.split_statistic('top+90:count'),
+                         ('top+90', 'count'))
+        self.assertRaises(RuntimeError, projector.split_statistic, 'top:')
+        self.assertRaises(RuntimeError, projector.split_statistic, 'top:min')
+
+
+class PlaneReader(object):
+    """Wraps a block to count the planes read from it, failing if the block
+    is reduced in any other way."""
+
+    def __init__(self, block):
+        self.block = block
+        self.shape = block.shape
+        self.reads = 0
+
+    def __getitem__(self, index):
+        self.reads += 1
+        return self.block[index]
+
+    def max(self, axis):
+        raise AssertionError(f"Extra traversal along axis {axis}")
+
+
+class AxisStatisticsTest(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(AxisStatisticsTest, self).__init__(*args, **kwargs)
+        self.projector = Projector()
+        self.block = build_block('000000101000110111100000000b', [3, 3, 3])
+
+    def test_statistics(self):
+        rng = np.random.default_rng(6)
+        block = rng.integers(0, 2, (4, 5, 6), dtype=np.uint8)
+        for axis in [X, Y, Z]:
+            statistics = AxisStatistics(block, axis)
+            hits = np.moveaxis(block, axis, -1) != 0
+            any_hit = hits.any(axis=-1)
+            first = np.where(any_hit, hits.argmax(axis=-1), -1)
+            last_hit = hits.shape[-1] - 1 - hits[..., ::-1].argmax(axis=-1)
+            last = np.where(any_hit, last_hit, -1)
+            assert_array_equal(block.max(axis=axis), statistics.max)
+            assert_array_equal(block.sum(axis=axis), statistics.count)
+            assert_array_equal(first, statistics.first)
+            assert_array_equal(last, statistics.last)
+
+    def test_expression_statistics(self):
+        blocks = {'d': self.block, 'l': np.flip(self.block, 1)}
+        expression = BlockExpression(ExpressionParser().parse('d ^ l'), blocks)
+        for axis in [X, Y, Z]:
+            statistics = AxisStatistics(expression, axis)
+            block = expression.evaluate()
+            assert_array_equal(block.sum(axis=axis), statistics.count)
+
+    def test_project(self):
+        statistics = {}
+        front_count = self.projector.project(self.block, 'front:count',
+                                             statistics)
+        front_max = self.projector.project(self.block, 'front:max', statistics)
+        back_depth = self.projector.project(self.block, 'back:depth',
+                                            statistics)
+        front_depth = self.projector.project(self.block, 'front:depth',
+                                             statistics)
+        self.assertEqual([Z], list(statistics))  # computed once for the axis
+        assert_array_equal([[1, 0, 0], [1, 1, 0], [2, 1, 2]], front_count)
+        assert_array_equal(self.projector.project(self.block, 'front'),
+                           front_max)
+        # depth is 0 on the near face and 3 (the length) for empty lines
+        assert_array_equal([[0, 3, 3], [1, 1, 3], [1, 1, 1]], front_depth)
+        assert_array_equal([[3, 3, 2], [3, 1, 1], [0, 1, 0]], back_depth)
+
+    def test_depth(self):
+        block = np.zeros((4, 3, 3), dtype=np.uint8)
+        block[1, 2, 0] = T  # one voxel deep behind the back face
+        front_depth = self.projector.project(block, 'front:depth')
+        back_depth = self.projector.project(block, 'back:depth')
+        assert_array_equal([[4, 4, 4], [4, 4, 4], [2, 4, 4]], front_depth)
+        assert_array_equal([[4, 4, 4], [4, 4, 4], [4, 4, 1]], back_depth)
+        images = self.projector.get_images(block, 'front:depth back:depth')
+        self.assertEqual("++    \n      \n      ", next(images))
+        self.assertEqual("    ##\n      \n      ", next(images))
+        pgms = self.projector.get_pgms(block, 'back:depth')
+        self.assertEqual("P2\n3 3\n4\n4 4 1\n4 4 4\n4 4 4", next(pgms))
+
+    def test_single_traversal(self):
+        reader = PlaneReader(self.block)
+        view_spec = 'front back:count front:depth back'
+        images = list(self.projector.get_images(reader, view_spec))
+        self.assertEqual(3, reader.reads)  # one plane at a time along Z
+        expected = self.projector.get_images(self.block, view_spec)
+        self.assertEqual(list(expected), images)
+
+    def test_images(self):
+        images = self.projector.get_images(self.block, 'front:count top')
+        self.assertEqual("**--**\n----  \n--    ", next(images))
+        self.assertEqual("XX  XX\nXXXXXX\nXX    ", next(images))
+        tiles = ['.', 'o', 'O']  # custom tiles are indexed by the values
+        images = self.projector.get_images(self.block, 'top front:count',
+                                           tiles)
+        self.assertEqual("o.o\nooo\no..", next(images))
+        self.assertEqual("OoO\noo.\no..", next(images))
+        pgms = self.projector.get_pgms(self.block, 'front:count')
+        self.assertEqual("P2\n3 3\n3\n2 1 2\n1 1 0\n1 0 0", next(pgms))
+
+
+class BlockExpressionTest(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(BlockExpressionTest, self).__init__(*args, **kwargs)
+        self.parser = ExpressionParser()
+        rng = np.random.default_rng(9)
+        self.blocks = {'d': rng.integers(0, 2, (5, 4, 3), dtype=np.uint8),
+                       'l': rng.integers(0, 2, (5, 4, 3), dtype=np.uint8)}
+
+    def create_expression(self, text):
+        return BlockExpression(self.parser.parse(text), self.blocks, 2)
+
+    def test_evaluate(self):
+        d = self.blocks['d']
+        l = self.blocks['l']
+        cases = {'d': d, '~d': 1 - d, 'd & ~l': d & (1 - l), 'd ^ l': d ^ l,
+                 'd | l & ~d': d | (l & (1 - d)), '~(d | l)': 1 - (d | l),
+                 '(d ^ l) & d': (d ^ l) & d}
+        for text, expected in cases.items():
+            expression = self.create_expression(text)
+            assert_array_equal(expected, expression.evaluate())
+        # the input blocks must not be overwritten by the evaluation
+        assert_array_equal(d, self.blocks['d'])
+
+    def test_max(self):
+        for text in ['d', 'd & ~l', 'd ^ l', 'd | ~l', '~(d & l) | l']:
+            expression = self.create_expression(text)
+            block = expression.evaluate()
+            for axis in [X, Y, Z]:
+                assert_array_equal(block.max(axis=axis), expression.max(axis))
+
+    def test_projector(self):
+        expression = self.create_expression('d & ~l')
+        projector = Projector()
+        for image, expected in zip(
+                projector.get_images(expression, 'top right+90'),
+                projector.get_images(expression.evaluate(), 'top right+90')):
+            self.assertEqual(expected, image)
+
+    def test_errors(self):
+        for text in ['', 'd &', 'd l', '(d', 'd + l', '~']:
+            self.assertRaises(RuntimeError, self.parser.parse, text)
+        self.assertRaises(RuntimeError, self.create_expression, 'd & q')
+        self.blocks['q'] = np.zeros((2, 2, 2), dtype=np.uint8)
+        self.assertRaises(RuntimeError, self.create_expression, 'd & q')
+
 
 if __name__ == '__main__':
     unittest.main()